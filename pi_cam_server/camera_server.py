@@ -4,75 +4,141 @@ Pi Camera Server - Standalone Application
 Minimal camera server for Raspberry Pi deployment
 """
 
+import io
+import itertools
+import json
+import selectors
 import socket
 import threading
 import time
 import os
-import yaml
 import logging
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from datetime import datetime
+from typing import List
 
-try:
-    from picamera2 import Picamera2
-    CAMERA_AVAILABLE = True
-except ImportError:
-    print("❌ picamera2 not available")
-    CAMERA_AVAILABLE = False
+log = logging.getLogger(__name__)
 
+def load_picamera2():
+    """Import Picamera2 on first use (it pulls in the libcamera bindings)"""
+    try:
+        from picamera2 import Picamera2
+        return Picamera2
+    except ImportError:
+        return None
+
+def load_config_data(config_path):
+    """Parse a YAML config file, reusing a JSON cache written next to it
+
+    The cache records the YAML file's mtime and is only used while that
+    still matches, so editing the YAML invalidates it.
+    """
+    cache_path = config_path + ".cache.json"
+    mtime_ns = os.stat(config_path).st_mtime_ns
+    try:
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+        if cached.get('mtime_ns') == mtime_ns:
+            return cached.get('data')
+    except (OSError, ValueError, AttributeError):
+        pass
+    
+    import yaml
+    # Prefer the libyaml-backed loader when PyYAML was built with it
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(config_path, 'r') as f:
+        data = yaml.load(f, Loader=loader)
+    
+    # Write to a temporary file and rename so readers never see a torn cache;
+    # the config may live somewhere read-only, which just means no cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'mtime_ns': mtime_ns, 'data': data}, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError, ValueError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return data
+
+@dataclass(slots=True)
 class SimpleCameraConfig:
     """Simple camera configuration"""
-    def __init__(self):
-        self.server_port = 2222
-        self.photo_directory = "photos"
-        self.focus_mode = "auto"
-        self.image_format = "jpeg"
-        self.image_quality = 85
-        self.rotation = 0
-        self.resolution = [1920, 1080]
-        self.hflip = False
-        self.vflip = False
-        self.brightness = 0
-        self.contrast = 0
-        self.saturation = 0
+    server_port: int = 2222
+    photo_directory: str = "photos"
+    persist_photos: bool = True
+    client_idle_timeout: float = 5.0
+    focus_mode: str = "auto"
+    image_format: str = "jpeg"
+    image_quality: int = 85
+    rotation: int = 0
+    resolution: List[int] = field(default_factory=lambda: [1920, 1080])
+    hflip: bool = False
+    vflip: bool = False
+    brightness: float = 0
+    contrast: float = 0
+    saturation: float = 0
 
     @classmethod
     def from_yaml(cls, config_path):
         """Load config from YAML file"""
         config = cls()
         try:
-            with open(config_path, 'r') as f:
-                data = yaml.safe_load(f)
-                if data:
-                    # Load server settings
-                    if 'server' in data:
-                        server = data['server']
-                        config.server_port = server.get('port', config.server_port)
-                        config.photo_directory = server.get('photo_directory', config.photo_directory)
-                    
-                    # Load camera settings
-                    if 'camera' in data:
-                        camera = data['camera']
-                        config.rotation = camera.get('rotation', config.rotation)
-                        config.image_format = camera.get('image_format', config.image_format)
-                        config.image_quality = camera.get('image_quality', config.image_quality)
-                        config.resolution = camera.get('resolution', config.resolution)
-                        config.focus_mode = camera.get('focus_mode', config.focus_mode)
+            data = load_config_data(config_path)
+            if data:
+                # Load server settings
+                if 'server' in data:
+                    server = data['server']
+                    config.server_port = server.get('port', config.server_port)
+                    config.photo_directory = server.get('photo_directory', config.photo_directory)
+                    config.persist_photos = server.get('persist_photos', config.persist_photos)
+                    config.client_idle_timeout = server.get('client_idle_timeout', config.client_idle_timeout)
+                
+                # Load camera settings
+                if 'camera' in data:
+                    camera = data['camera']
+                    config.rotation = camera.get('rotation', config.rotation)
+                    config.image_format = camera.get('image_format', config.image_format)
+                    config.image_quality = camera.get('image_quality', config.image_quality)
+                    config.resolution = camera.get('resolution', config.resolution)
+                    config.focus_mode = camera.get('focus_mode', config.focus_mode)
+                
+                # Load advanced settings
+                if 'advanced' in data:
+                    advanced = data['advanced']
+                    config.hflip = advanced.get('hflip', config.hflip)
+                    config.vflip = advanced.get('vflip', config.vflip)
+                    config.brightness = advanced.get('brightness', config.brightness)
+                    config.contrast = advanced.get('contrast', config.contrast)
+                    config.saturation = advanced.get('saturation', config.saturation)
                     
-                    # Load advanced settings
-                    if 'advanced' in data:
-                        advanced = data['advanced']
-                        config.hflip = advanced.get('hflip', config.hflip)
-                        config.vflip = advanced.get('vflip', config.vflip)
-                        config.brightness = advanced.get('brightness', config.brightness)
-                        config.contrast = advanced.get('contrast', config.contrast)
-                        config.saturation = advanced.get('saturation', config.saturation)
-                        
         except Exception as e:
-            print(f"⚠️  Could not load config from {config_path}: {e}")
+            log.warning("⚠️  Could not load config from %s: %s", config_path, e)
         return config
 
+# libcamera.Transform arguments for each supported rotation (degrees)
+ROTATION_TRANSFORMS = {
+    0: {},
+    90: {"hflip": False, "vflip": True, "transpose": True},
+    180: {"hflip": True, "vflip": True},
+    270: {"hflip": True, "vflip": False, "transpose": True},
+}
+
+def send_buffers(sock, buffers):
+    """Send several buffers with vectored writes, without joining them"""
+    views = [memoryview(b) for b in buffers]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views:
+            views[0] = views[0][sent:]
+
 class SimpleCameraServer:
     """Simple camera server for Pi"""
     
@@ -81,180 +147,221 @@ class SimpleCameraServer:
         self.server_socket = None
         self.running = False
         
-        # Ensure photo directory exists
-        Path(self.config.photo_directory).mkdir(exist_ok=True)
+        # Bounded worker pool for client connections; the camera itself is
+        # a single shared device, so captures are serialized by a lock
+        self.pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cam")
+        self.camera_lock = threading.Lock()
+        self.client_sockets = set()
+        
+        # Photo names are a startup timestamp plus a sequence number, so
+        # captures within the same second never collide
+        self._session = time.strftime("%Y%m%d-%H%M%S")
+        self._counter = itertools.count()
+        
+        # Ensure photo directory exists, and keep its path as a plain string
+        # so saving a photo doesn't build Path objects per capture
+        self._photo_dir = None
+        if self.config.persist_photos:
+            photo_dir = Path(self.config.photo_directory).resolve()
+            photo_dir.mkdir(exist_ok=True)
+            self._photo_dir = str(photo_dir)
         
         # Initialize camera
         self.camera = None
-        if CAMERA_AVAILABLE:
+        Picamera2 = load_picamera2()
+        if Picamera2:
             try:
-                print("🔍 Initializing camera...")
+                log.info("🔍 Initializing camera...")
                 self.camera = Picamera2()
                 
-                # Test camera with basic configuration
-                config = self.camera.create_still_configuration()
-                self.camera.configure(config)
-                print("✅ Camera initialized successfully")
+                # Configure and start the pipeline once; captures reuse it
+                self._configure_camera()
+                log.info("✅ Camera initialized successfully")
                 
             except Exception as e:
-                print(f"❌ Camera initialization failed: {e}")
-                print("💡 Troubleshooting tips:")
-                print("   1. Check camera is enabled: sudo raspi-config → Interface Options → Camera → Enable")
-                print("   2. Check camera connection (ribbon cable)")
-                print("   3. Reboot Pi: sudo reboot")
-                print("   4. Check no other process using camera: sudo fuser /dev/video*")
-                print("   5. Test camera manually: rpicam-still -o test.jpg")
+                log.error("❌ Camera initialization failed: %s", e)
+                log.info("💡 Troubleshooting tips:")
+                log.info("   1. Check camera is enabled: sudo raspi-config → Interface Options → Camera → Enable")
+                log.info("   2. Check camera connection (ribbon cable)")
+                log.info("   3. Reboot Pi: sudo reboot")
+                log.info("   4. Check no other process using camera: sudo fuser /dev/video*")
+                log.info("   5. Test camera manually: rpicam-still -o test.jpg")
                 self.camera = None
         else:
-            print("❌ picamera2 not available")
-            print("💡 Install with: sudo apt install python3-picamera2")
+            log.error("❌ picamera2 not available")
+            log.info("💡 Install with: sudo apt install python3-picamera2")
+
+    def _configure_camera(self):
+        """Configure the still pipeline (size, rotation, controls) and start the camera"""
+        config = self.camera.create_still_configuration(
+            main={"size": tuple(self.config.resolution)}
+        )
+        
+        # Apply rotation and flip settings
+        if self.config.rotation != 0 or self.config.hflip or self.config.vflip:
+            try:
+                import libcamera
+                transform_args = ROTATION_TRANSFORMS.get(self.config.rotation, {})
+                config["transform"] = libcamera.Transform(**transform_args)
+                # Note: Additional flip logic would go here if needed
+            except ImportError:
+                if self.config.rotation != 0:
+                    log.warning("⚠️  libcamera not available for rotation, using software rotation")
+        
+        self.camera.configure(config)
+        
+        # JPEG quality used by the encoder for every capture
+        self.camera.options["quality"] = self.config.image_quality
+        self.camera.start()
+        
+        # Apply camera controls if available; they persist across captures
+        try:
+            controls = {}
+            if self.config.brightness != 0:
+                controls["Brightness"] = self.config.brightness / 100.0
+            if self.config.contrast != 0:
+                controls["Contrast"] = 1.0 + (self.config.contrast / 100.0)
+            if self.config.saturation != 0:
+                controls["Saturation"] = 1.0 + (self.config.saturation / 100.0)
+            
+            if controls:
+                self.camera.set_controls(controls)
+        except Exception as e:
+            log.warning("⚠️  Could not apply camera controls: %s", e)
 
-    def take_photo(self) -> str:
-        """Take a photo and return the filename"""
+    def take_photo(self):
+        """Take a photo and return (filename, JPEG data as a memoryview)"""
         if not self.camera:
             raise Exception("Camera not available")
         
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        filename = f"capture_{timestamp}.jpg"
-        filepath = Path(self.config.photo_directory) / filename
+        filename = f"capture_{self._session}_{next(self._counter):06d}.jpg"
         
         try:
-            # Create camera configuration with rotation and settings
-            config = self.camera.create_still_configuration(
-                main={"size": tuple(self.config.resolution)}
-            )
-            
-            # Apply rotation if specified
-            if self.config.rotation != 0:
-                try:
-                    import libcamera
-                    transform = libcamera.Transform()
-                    
-                    # Apply rotation
-                    if self.config.rotation == 90:
-                        transform = libcamera.Transform(hflip=False, vflip=True, transpose=True)
-                    elif self.config.rotation == 180:
-                        transform = libcamera.Transform(hflip=True, vflip=True)
-                    elif self.config.rotation == 270:
-                        transform = libcamera.Transform(hflip=True, vflip=False, transpose=True)
-                    
-                    config["transform"] = transform
-                except ImportError:
-                    print("⚠️  libcamera not available for rotation, using software rotation")
-            
-            # Apply flip settings
-            if self.config.hflip or self.config.vflip:
-                try:
-                    import libcamera
-                    if "transform" not in config:
-                        config["transform"] = libcamera.Transform()
-                    # Note: Additional flip logic would go here if needed
-                except ImportError:
-                    pass
-            
-            self.camera.configure(config)
-            self.camera.start()
-            
-            # Apply camera controls if available
-            try:
-                controls = {}
-                if hasattr(self.config, 'brightness') and self.config.brightness != 0:
-                    controls["Brightness"] = self.config.brightness / 100.0
-                if hasattr(self.config, 'contrast') and self.config.contrast != 0:
-                    controls["Contrast"] = 1.0 + (self.config.contrast / 100.0)
-                if hasattr(self.config, 'saturation') and self.config.saturation != 0:
-                    controls["Saturation"] = 1.0 + (self.config.saturation / 100.0)
-                
-                if controls:
-                    self.camera.set_controls(controls)
-            except Exception as e:
-                print(f"⚠️  Could not apply camera controls: {e}")
-            
-            # Capture image
-            self.camera.capture_file(str(filepath))
-            self.camera.stop()
+            # Capture and encode in memory from the already-running pipeline
+            buffer = io.BytesIO()
+            with self.camera_lock:
+                self.camera.capture_file(buffer, format="jpeg")
             
-            print(f"📸 Photo captured: {filename} (rotation: {self.config.rotation}°)")
-            return str(filepath)
+            log.info("📸 Photo captured: %s (rotation: %s°)", filename, self.config.rotation)
+            # Hand out a view of the encoder output rather than a copy
+            return filename, buffer.getbuffer()
             
         except Exception as e:
-            print(f"❌ Photo capture failed: {e}")
+            log.error("❌ Photo capture failed: %s", e)
             raise
 
+    def save_photo(self, filename, photo_data):
+        """Keep a copy of a captured photo in the photo directory"""
+        filepath = os.path.join(self._photo_dir, filename)
+        try:
+            with open(filepath, 'wb') as f:
+                f.write(photo_data)
+        except Exception as e:
+            log.warning("⚠️  Could not save %s: %s", filepath, e)
+
     def handle_client(self, client_socket, client_address):
-        """Handle client connection"""
+        """Handle client connection
+
+        Commands are served until the client closes the connection, so a
+        client can reuse one connection for a burst of captures. Connections
+        left idle longer than client_idle_timeout are closed, so idle or
+        vanished clients can't hold on to the pool's few workers.
+        """
         try:
-            print(f"📱 Client connected: {client_address}")
-            
-            # Receive command
-            command = client_socket.recv(1024).decode().strip()
-            print(f"📋 Command: {command}")
-            
-            if command == "CAPTURE":
+            log.debug("📱 Client connected: %s", client_address)
+            self.client_sockets.add(client_socket)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            client_socket.settimeout(self.config.client_idle_timeout)
+
+            # One receive buffer per connection, reused for every command
+            command_buffer = memoryview(bytearray(1024))
+            while self.running:
+                # Receive command
                 try:
-                    photo_path = self.take_photo()
-                    
-                    # Send photo file
-                    with open(photo_path, 'rb') as f:
-                        photo_data = f.read()
-                    
-                    # Send response header
-                    response = f"OK {len(photo_data)}\n".encode()
-                    client_socket.send(response)
-                    
-                    # Send photo data
-                    client_socket.send(photo_data)
-                    print(f"📤 Sent {len(photo_data)} bytes")
-                    
-                except Exception as e:
-                    error_msg = f"ERROR {str(e)}\n".encode()
-                    client_socket.send(error_msg)
-                    print(f"❌ Error: {e}")
-            
-            elif command == "TEST":
-                response = "OK Camera server ready\n".encode()
-                client_socket.send(response)
-                print("✅ Test response sent")
-            
-            else:
-                response = "ERROR Unknown command\n".encode()
-                client_socket.send(response)
-                print(f"❌ Unknown command: {command}")
-                
+                    n = client_socket.recv_into(command_buffer)
+                except socket.timeout:
+                    log.debug("📱 Closing idle connection: %s", client_address)
+                    break
+                command = command_buffer[:n].tobytes().strip()
+                if not command:
+                    break
+                log.debug("📋 Command: %r", command)
+
+                if command == b"CAPTURE":
+                    try:
+                        filename, photo_data = self.take_photo()
+
+                        # Send response header and photo data together
+                        response = f"OK {len(photo_data)}\n".encode()
+                        send_buffers(client_socket, [response, photo_data])
+                        log.debug("📤 Sent %d bytes", len(photo_data))
+
+                        # Keep a copy on the Pi once the client has its photo
+                        if self.config.persist_photos:
+                            self.save_photo(filename, photo_data)
+
+                    except Exception as e:
+                        error_msg = f"ERROR {str(e)}\n".encode()
+                        client_socket.sendall(error_msg)
+                        log.error("❌ Error: %s", e)
+
+                elif command == b"TEST":
+                    response = "OK Camera server ready\n".encode()
+                    client_socket.sendall(response)
+                    log.debug("✅ Test response sent")
+
+                else:
+                    response = "ERROR Unknown command\n".encode()
+                    client_socket.sendall(response)
+                    log.warning("❌ Unknown command: %r", command)
+
         except Exception as e:
-            print(f"❌ Client handling error: {e}")
+            log.error("❌ Client handling error: %s", e)
         finally:
+            self.client_sockets.discard(client_socket)
             client_socket.close()
-            print(f"📱 Client disconnected: {client_address}")
+            log.debug("📱 Client disconnected: %s", client_address)
 
     def start_server(self):
         """Start the camera server"""
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # Large send buffer for multi-MB photos; accepted sockets inherit it
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
             self.server_socket.bind(('0.0.0.0', self.config.server_port))
             self.server_socket.listen(5)
             
+            # Wait for connections with epoll (on Linux) and a short timeout
+            # so stop_server() is noticed promptly
+            self.server_socket.setblocking(False)
+            selector = selectors.DefaultSelector()
+            selector.register(self.server_socket, selectors.EVENT_READ)
+            
             self.running = True
-            print(f"🎥 Camera server listening on port {self.config.server_port}")
-            print("   Ready for connections...")
+            log.info("🎥 Camera server listening on port %d", self.config.server_port)
+            log.info("   Ready for connections...")
             
-            while self.running:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, client_address)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-                    
-                except Exception as e:
-                    if self.running:
-                        print(f"❌ Accept error: {e}")
+            try:
+                while self.running:
+                    try:
+                        if not selector.select(timeout=0.5):
+                            continue
+                        client_socket, client_address = self.server_socket.accept()
+                        client_socket.setblocking(True)
+                        self.pool.submit(self.handle_client, client_socket, client_address)
+                        
+                    except BlockingIOError:
+                        continue
+                    except Exception as e:
+                        if self.running:
+                            log.error("❌ Accept error: %s", e)
+            finally:
+                selector.close()
                         
         except Exception as e:
-            print(f"❌ Server start error: {e}")
+            log.error("❌ Server start error: %s", e)
         finally:
             self.stop_server()
 
@@ -263,9 +370,17 @@ class SimpleCameraServer:
         self.running = False
         if self.server_socket:
             self.server_socket.close()
+        # Unblock handlers waiting on idle persistent connections
+        for client_socket in list(self.client_sockets):
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.pool.shutdown(wait=False, cancel_futures=True)
         if self.camera:
+            self.camera.stop()
             self.camera.close()
-        print("🛑 Camera server stopped")
+        log.info("🛑 Camera server stopped")
 
 def setup_logging(log_level: str = "INFO"):
     """Setup logging for Pi deployment"""
@@ -292,10 +407,10 @@ def load_config():
     
     for config_path in config_paths:
         if os.path.exists(config_path):
-            print(f"📝 Loading config from: {config_path}")
+            log.info("📝 Loading config from: %s", config_path)
             return SimpleCameraConfig.from_yaml(config_path)
     
-    print("📝 Using default configuration")
+    log.info("📝 Using default configuration")
     return SimpleCameraConfig()
 
 def main():
@@ -335,6 +450,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-if __name__ == "__main__":
-    main()
@@ -11,6 +11,12 @@ from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, Any
 
+# Prefer the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 class PiCamConfig:
     """Simple camera configuration"""
     def __init__(self, hostname="raspberrypi.local", port=2222, download_dir="photos"):
@@ -30,7 +36,7 @@ class PiCamConfig:
             return cls()
         
         with open(config_path, 'r') as f:
-            data = yaml.safe_load(f)
+            data = yaml.load(f, Loader=SafeLoader)
         
         # Extract server config
         server_config = data.get('server', {})
@@ -50,41 +56,142 @@ class PiCam:
     - Connect to Pi camera server
     - Capture photos
     - Test connections
+    
+    The connection to the server is kept open between calls, so burst
+    captures only pay for one TCP handshake. Use it as a context manager
+    (or call close()) to release the connection:
+    
+        with PiCam(config) as cam:
+            for _ in range(20):
+                cam.capture_photo()
     """
     
     def __init__(self, config: Optional[PiCamConfig] = None):
         """Initialize camera client"""
         self.config = config or PiCamConfig()
+        self._sock = None
+        self._rfile = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _connect(self) -> socket.socket:
+        """Open a TCP connection to the camera server"""
+        # Sockets are built by hand rather than with socket.create_connection()
+        # so the options below are in place before the handshake
+        error = None
+        for family, sock_type, proto, _, address in socket.getaddrinfo(
+                self.config.hostname, self.config.port, type=socket.SOCK_STREAM):
+            sock = socket.socket(family, sock_type, proto)
+            try:
+                # Large receive buffer for multi-MB photos; set before connect()
+                # so the window it allows is advertised in the SYN
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+                # Detect a server that went away while the connection sits idle
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                # Commands are tiny; don't let Nagle hold them back
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.settimeout(self.config.timeout)
+                sock.connect(address)
+                return sock
+            except OSError as e:
+                sock.close()
+                error = e
+        raise error or OSError(f"Could not resolve {self.config.hostname}")
+    
+    def _ensure_connected(self):
+        """Open the persistent connection if it isn't open yet"""
+        if self._sock is None:
+            self._sock = self._connect()
+            # Buffered reader so header lines cost one recv, not one per byte
+            self._rfile = self._sock.makefile('rb')
+    
+    def _send_command(self, command: str) -> str:
+        """Send a command and return the server's response header line"""
+        reused = self._sock is not None
+        self._ensure_connected()
+        try:
+            self._sock.sendall(command.encode('utf-8'))
+            header = self._rfile.readline()
+        except (ConnectionResetError, BrokenPipeError):
+            # Only a dropped connection is retried; a timeout means the
+            # server may still be working on the command, so it propagates
+            if not reused:
+                raise
+            header = b""
+        
+        if not header and reused:
+            # Server closed the idle connection; retry once on a fresh one
+            self.close()
+            self._ensure_connected()
+            self._sock.sendall(command.encode('utf-8'))
+            header = self._rfile.readline()
         
+        return header.decode('utf-8').strip()
+    
+    def close(self):
+        """Close the connection to the camera server"""
+        if self._rfile:
+            self._rfile.close()
+            self._rfile = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+    
     def test_connection(self) -> bool:
         """Test if camera server is accessible"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self.config.timeout)
-            result = sock.connect_ex((self.config.hostname, self.config.port))
-            sock.close()
-            return result == 0
+            self._connect().close()
+            return True
         except Exception:
             return False
     
     def get_status(self) -> str:
         """Get detailed camera server status"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self.config.timeout)
-            sock.connect((self.config.hostname, self.config.port))
-            
-            # Send status command
-            sock.send("STATUS".encode('utf-8'))
-            
-            # Receive response
-            response = sock.recv(1024).decode().strip()
-            sock.close()
-            return response
-            
+            return self._send_command("STATUS")
         except Exception as e:
+            self.close()
             return f"Connection failed: {e}"
     
+    def _receive_photo(self) -> Optional[bytearray]:
+        """Request a capture and return the JPEG bytes, or None if failed"""
+        # Send capture command and read the "OK {length}" header
+        response = self._send_command("CAPTURE")
+        if not response.startswith("OK"):
+            print(f"Server error: {response}")
+            return None
+        
+        # Parse data length from response "OK {length}"
+        try:
+            data_length = int(response.split()[1])
+        except (IndexError, ValueError):
+            print("Invalid server response format")
+            self.close()
+            return None
+        
+        # Receive photo data straight into a preallocated buffer
+        # (the reader hands over anything it buffered past the header)
+        photo_data = bytearray(data_length)
+        view = memoryview(photo_data)
+        received_size = 0
+        while received_size < data_length:
+            chunk_size = min(65536, data_length - received_size)
+            n = self._rfile.readinto(view[received_size:received_size + chunk_size])
+            if not n:
+                break
+            received_size += n
+        
+        if received_size != data_length:
+            print(f"Incomplete download: {received_size}/{data_length} bytes")
+            self.close()
+            return None
+        
+        return photo_data
+    
     def capture_photo(self, filename: Optional[str] = None) -> Optional[str]:
         """
         Capture a photo from Pi camera server
@@ -96,67 +203,59 @@ class PiCam:
             Path to saved photo or None if failed
         """
         try:
-            # Connect to server
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self.config.timeout)
-            sock.connect((self.config.hostname, self.config.port))
-            
-            # Send capture command
-            sock.send("CAPTURE".encode('utf-8'))
-            
-            # Receive response header (read until newline)
-            response_bytes = b""
-            while b"\n" not in response_bytes:
-                chunk = sock.recv(1)
-                if not chunk:
-                    break
-                response_bytes += chunk
-            
-            response = response_bytes.decode('utf-8').strip()
-            if not response.startswith("OK"):
-                print(f"Server error: {response}")
-                sock.close()
-                return None
-            
-            # Parse data length from response "OK {length}"
-            try:
-                data_length = int(response.split()[1])
-            except (IndexError, ValueError):
-                print("Invalid server response format")
-                sock.close()
+            photo_data = self._receive_photo()
+            if photo_data is None:
                 return None
             
             # Generate filename if not provided
             if filename:
                 file_path = Path(self.config.download_dir) / filename
             else:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                # Microseconds keep names unique for back-to-back captures
+                # over the persistent connection
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
                 file_path = Path(self.config.download_dir) / f"capture_{timestamp}.jpg"
             
-            # Receive photo data
-            received_size = 0
             with open(file_path, 'wb') as f:
-                while received_size < data_length:
-                    remaining = data_length - received_size
-                    chunk_size = min(4096, remaining)
-                    chunk = sock.recv(chunk_size)
-                    
-                    if not chunk:
-                        break
-                    
-                    f.write(chunk)
-                    received_size += len(chunk)
-            
-            sock.close()
+                f.write(photo_data)
+            return str(file_path)
+                
+        except Exception as e:
+            print(f"Photo capture failed: {e}")
+            self.close()
+            return None
+    
+    def capture_array(self, grayscale: bool = False):
+        """
+        Capture a photo and decode it in memory, skipping the disk round-trip
+        
+        Args:
+            grayscale: Decode straight to a single channel (e.g. for detection)
             
-            if received_size == data_length:
-                return str(file_path)
-            else:
-                print(f"Incomplete download: {received_size}/{data_length} bytes")
+        Returns:
+            Image as a numpy array (BGR or grayscale) or None if failed
+        """
+        try:
+            import cv2
+            import numpy as np
+        except ImportError:
+            print("❌ Install OpenCV: pip install opencv-python numpy")
+            return None
+        
+        try:
+            photo_data = self._receive_photo()
+            if photo_data is None:
                 return None
-                
+            
+            flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+            image = cv2.imdecode(np.frombuffer(photo_data, dtype=np.uint8), flags)
+            if image is None:
+                print("Could not decode photo")
+            return image
+            
         except Exception as e:
             print(f"Photo capture failed: {e}")
+            self.close()
             return None
     
     def get_latest_photo(self) -> Optional[str]:
@@ -165,19 +264,23 @@ class PiCam:
         if not photo_dir.exists():
             return None
         
-        photo_files = list(photo_dir.glob("*.jpg")) + list(photo_dir.glob("*.jpeg"))
-        if not photo_files:
-            return None
+        # Single directory pass; DirEntry.stat() is cached per entry
+        with os.scandir(photo_dir) as entries:
+            latest = max(
+                (entry for entry in entries
+                 if entry.is_file() and entry.name.lower().endswith(('.jpg', '.jpeg'))),
+                key=lambda entry: entry.stat().st_ctime,
+                default=None
+            )
         
-        latest = max(photo_files, key=os.path.getctime)
-        return str(latest)
+        return latest.path if latest else None
 
 # Convenience functions for quick usage
 def capture_photo(hostname: str = "raspberrypi.local", port: int = 2222) -> Optional[str]:
     """Quick photo capture function"""
     config = PiCamConfig(hostname, port)
-    camera = PiCam(config)
-    return camera.capture_photo()
+    with PiCam(config) as camera:
+        return camera.capture_photo()
 
 def test_camera(hostname: str = "raspberrypi.local", port: int = 2222) -> bool:
     """Quick connection test function"""
@@ -188,17 +291,16 @@ def test_camera(hostname: str = "raspberrypi.local", port: int = 2222) -> bool:
 # Example usage
 if __name__ == "__main__":
     # Simple test
-    camera = PiCam()
-    
-    print("Testing camera connection...")
-    if camera.test_connection():
-        print("✅ Connected to camera server")
-        
-        print("Capturing photo...")
-        photo_path = camera.capture_photo()
-        if photo_path:
-            print(f"📸 Photo saved: {photo_path}")
+    with PiCam() as camera:
+        print("Testing camera connection...")
+        if camera.test_connection():
+            print("✅ Connected to camera server")
+            
+            print("Capturing photo...")
+            photo_path = camera.capture_photo()
+            if photo_path:
+                print(f"📸 Photo saved: {photo_path}")
+            else:
+                print("❌ Failed to capture photo")
         else:
-            print("❌ Failed to capture photo")
-    else:
-        print("❌ Cannot connect to camera server")
+            print("❌ Cannot connect to camera server")